@@ -1,84 +1,194 @@
+import atexit
+import heapq
 import toml
 from datetime import datetime, timedelta
 import json
 import os
+import re
+import sqlite3
 from pathlib import Path
 
+try:
+    import tomllib
+except ModuleNotFoundError:  # Python 3.10, fall back to the pure-Python toml parser
+    tomllib = None
+
+ELEVENLABS_KEY_PATTERN = re.compile(r"""^(\s*elevenlabs_api_key\s*=\s*)(?:"[^"\n]*"|'[^'\n]*')""", re.MULTILINE)
+
+# State file used before the rotator moved to SQLite, imported once on first run
+LEGACY_KEY_STORAGE_PATH = 'api_keys.json'
+
 class APIKeyRotator:
-    def __init__(self, config_path='config.toml', key_storage_path='api_keys.json'):
+    MAX_USES = 8
+    # Plain use-count increments are only written to disk every FLUSH_EVERY uses (and on exit).
+    # Must stay below MAX_USES, retiring a key already saves immediately
+    FLUSH_EVERY = MAX_USES // 2
+    RETIREMENT_PERIOD = timedelta(days=30)
+
+    def __init__(self, config_path='config.toml', key_storage_path='api_keys.db'):
         self.config_path = config_path
         self.key_storage_path = key_storage_path
         self.api_keys = {
             'sk_yourElevenLabsKey': {'uses': 0, 'retired_date': None},
             'sk_otherElevenLabsKey': {'uses': 0, 'retired_date': None},
         }
+        self._dirty = False
+        self._pending_uses = 0
+        # Keys whose row has to be written on the next save
+        self._changed = set()
+        # Key handed out last, reused until it hits MAX_USES
+        self._active = None
+        # (retired_date, key) min-heap, so the next key due for reactivation is always on top
+        self._retired_heap = []
+        # Parsed API key of config.toml and the mtime it was read at
+        self._config_key = None
+        self._config_mtime = None
         self.initialize_storage()
+        self.build_retired_heap()
+        atexit.register(self.flush)
 
     def initialize_storage(self):
         # Initialize or load API keys storage
-        if os.path.exists(self.key_storage_path):
-            with open(self.key_storage_path, 'r') as f:
-                self.api_keys = json.load(f)
+        self.conn = sqlite3.connect(self.key_storage_path)
+        # WAL appends changed pages instead of rewriting the database file
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS keys (name TEXT PRIMARY KEY, uses INTEGER NOT NULL, retired_date TEXT)"
+            )
+
+        rows = self.conn.execute("SELECT name, uses, retired_date FROM keys ORDER BY rowid").fetchall()
+        if rows:
+            self.api_keys = {name: {'uses': uses, 'retired_date': retired_date} for name, uses, retired_date in rows}
         else:
+            if os.path.exists(LEGACY_KEY_STORAGE_PATH):
+                with open(LEGACY_KEY_STORAGE_PATH, 'r') as f:
+                    self.api_keys = json.load(f)
+            self._changed.update(self.api_keys)
             self.save_key_storage()
 
     def save_key_storage(self):
-        with open(self.key_storage_path, 'w') as f:
-            json.dump(self.api_keys, f, indent=4)
+        # Upsert only the rows that changed, all in one transaction
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO keys (name, uses, retired_date) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET uses = excluded.uses, retired_date = excluded.retired_date",
+                [(key, self.api_keys[key]['uses'], self.api_keys[key]['retired_date']) for key in self._changed],
+            )
+        self._changed.clear()
+        self._dirty = False
+        self._pending_uses = 0
+
+    def build_retired_heap(self):
+        self._retired_heap = [
+            (datetime.fromisoformat(info['retired_date']), key)
+            for key, info in self.api_keys.items()
+            if info['retired_date']
+        ]
+        heapq.heapify(self._retired_heap)
+
+    def retire_key(self, key):
+        retired_date = datetime.now()
+        self.api_keys[key]['retired_date'] = retired_date.isoformat()
+        heapq.heappush(self._retired_heap, (retired_date, key))
+        self._changed.add(key)
+        if self._active == key:
+            self._active = None
+        self._dirty = True
+
+    def is_available(self, key):
+        info = self.api_keys[key]
+        return info['retired_date'] is None and info['uses'] < self.MAX_USES
+
+    def flush(self):
+        if self._dirty or self._pending_uses:
+            self.save_key_storage()
 
     def get_active_api_key(self):
-        current_time = datetime.now()
-        
-        # Check for keys that can be reactivated
-        for key, info in self.api_keys.items():
-            if info['retired_date']:
-                retired_date = datetime.fromisoformat(info['retired_date'])
-                if current_time - retired_date >= timedelta(days=30):
-                    info['retired_date'] = None
-                    info['uses'] = 0
+        # Keys retired on or before this moment are due for reactivation
+        cutoff = datetime.now() - self.RETIREMENT_PERIOD
+
+        # Reactivate keys whose retirement period is over, oldest retirement first
+        while self._retired_heap and self._retired_heap[0][0] <= cutoff:
+            retired_date, key = heapq.heappop(self._retired_heap)
+            info = self.api_keys[key]
+            # Skip stale entries left behind by a key that was retired more than once
+            if info['retired_date'] != retired_date.isoformat():
+                continue
+            info['retired_date'] = None
+            info['uses'] = 0
+            self._changed.add(key)
+            self._dirty = True
+
+        # Keep handing out the same key until it is used up
+        if self._active is not None and self.is_available(self._active):
+            return self._active
 
         # Find an available key
-        for key, info in self.api_keys.items():
-            if info['retired_date'] is None and info['uses'] < 8:
+        for key in self.api_keys:
+            if self.is_available(key):
+                self._active = key
                 return key
 
         raise Exception("No available API keys found!")
 
-    def update_config(self, new_key):
-        # Read the current config
+    def load_config(self):
+        if tomllib is not None:
+            with open(self.config_path, 'rb') as f:
+                return tomllib.load(f)
         with open(self.config_path, 'r') as f:
-            config = toml.load(f)
+            return toml.load(f)
 
-        # Update the API key
-        config['settings']['tts']['elevenlabs_api_key'] = new_key
+    def get_config_key(self):
+        # Only re-parse the config when it changed on disk since the last run()
+        mtime = os.stat(self.config_path).st_mtime_ns
+        if mtime != self._config_mtime:
+            self._config_key = self.load_config()['settings']['tts']['elevenlabs_api_key']
+            self._config_mtime = mtime
+        return self._config_key
 
-        # Write the updated config back
-        with open(self.config_path, 'w') as f:
-            toml.dump(config, f)
+    def update_config(self, new_key):
+        # Read the current config
+        with open(self.config_path, 'r') as f:
+            text = f.read()
+
+        # Swap only the API key value in place instead of re-serializing the whole config
+        text, count = ELEVENLABS_KEY_PATTERN.subn(lambda m: f'{m.group(1)}"{new_key}"', text, count=1)
+        if count == 0:
+            raise Exception(f"No elevenlabs_api_key found in {self.config_path}!")
+
+        # Write to a temp file and swap it in so a crash never leaves a truncated config
+        tmp_path = f"{self.config_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.config_path)
+        self._config_key = new_key
+        self._config_mtime = os.stat(self.config_path).st_mtime_ns
 
     def run(self):
-        current_key = None
-
         # Load current config to get the current key
-        with open(self.config_path, 'r') as f:
-            config = toml.load(f)
-            current_key = config['settings']['tts']['elevenlabs_api_key']
+        current_key = self.get_config_key()
 
         # Update the use count for the current key
         if current_key in self.api_keys:
             self.api_keys[current_key]['uses'] += 1
+            self._pending_uses += 1
+            self._changed.add(current_key)
 
             # Check if the current key needs to be rotated
-            if self.api_keys[current_key]['uses'] >= 8:
+            if self.api_keys[current_key]['uses'] >= self.MAX_USES:
                 # Retire the current key
-                self.api_keys[current_key]['retired_date'] = datetime.now().isoformat()
+                self.retire_key(current_key)
 
                 # Get a new key and update the config
                 new_key = self.get_active_api_key()
                 self.update_config(new_key)
 
-        # Save the updated state
-        self.save_key_storage()
+        # Save the updated state right away on rotation, otherwise once enough uses have piled up
+        if self._dirty or self._pending_uses >= self.FLUSH_EVERY:
+            self.save_key_storage()
 
 if __name__ == "__main__":
     rotator = APIKeyRotator()
@@ -47,17 +47,19 @@ checkversion(__VERSION__)
 
 reddit_id: str
 reddit_object: Dict[str, str | list]
+key_rotator: APIKeyRotator | None = None
 
 
 def main(POST_ID=None) -> None:
-    global reddit_id, reddit_object
+    global reddit_id, reddit_object, key_rotator
     reddit_object = get_subreddit_threads(POST_ID)
     reddit_id = extract_id(reddit_object)
     print_substep(f"Thread ID is {reddit_id}", style="bold blue")
-    # rotate api key
+    # rotate api key, reusing one rotator so batched use counts carry over between posts
     if settings.config["settings"]["tts"]["voice_choice"] == "elevenlabs":
-        rotator = APIKeyRotator()
-        rotator.run()
+        if key_rotator is None:
+            key_rotator = APIKeyRotator()
+        key_rotator.run()
     length, number_of_comments = save_text_to_mp3(reddit_object)
     length = math.ceil(length)
     get_screenshots_of_reddit_posts(reddit_object, number_of_comments)
@@ -1,3 +1,4 @@
+import functools
 import os
 import subprocess
 import zipfile
@@ -140,3 +141,51 @@ def ffmpeg_install():
         )
         print(e)
     return None
+
+
+@functools.lru_cache(maxsize=None)
+def has_nvenc() -> bool:
+    """Checks once per run whether ffmpeg can actually encode with h264_nvenc.
+
+    A listed encoder is not enough (the build may ship it without a usable GPU),
+    so this encodes a single blank frame and checks the exit code.
+    """
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-f", "lavfi", "-i", "color=black:s=256x256"]
+            + ["-frames:v", "1", "-c:v", "h264_nvenc", "-f", "null", "-"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        return False
+    return result.returncode == 0
+
+
+@functools.lru_cache(maxsize=None)
+def get_ffmpeg_filters() -> dict:
+    """Maps each filter the installed ffmpeg was built with to its flags (cached per run)."""
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-filters"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+    except FileNotFoundError:
+        return {}
+    # Filter lines look like " TSC scale_cuda        V->V       GPU accelerated video resizer"
+    return {
+        line.split()[1]: line.split()[0]
+        for line in result.stdout.splitlines()
+        if len(line.split()) > 2 and "->" in line.split()[2]
+    }
+
+
+def has_timeline_support(name: str) -> bool:
+    """Whether the filter accepts the enable= timeline option ("T" flag in ffmpeg -filters)."""
+    return get_ffmpeg_filters().get(name, "").startswith("T")
+
+
+def has_filters(*names: str) -> bool:
+    return all(name in get_ffmpeg_filters() for name in names)
@@ -1,64 +1,86 @@
+import functools
 import os
 import sys
 import json
-import wave
-import urllib.request
 import zipfile
 import subprocess
-from moviepy.editor import VideoFileClip, CompositeVideoClip, ImageClip
-import numpy as np
-from PIL import Image, ImageDraw, ImageFont
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from PIL import ImageFont
 from vosk import Model, KaldiRecognizer, SetLogLevel
+from utils.ffmpeg_install import has_nvenc
 import argparse
 
+SAMPLE_RATE = 16000
+# Bytes of 16-bit mono PCM handed to Vosk per call (64k samples)
+BLOCK_SIZE = 128000
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# Loaded Vosk models by path, so batch runs in one process only pay the model load once
+_MODEL_CACHE = {}
+
+def extract_zip(zip_path, dest):
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        files = [member for member in zip_ref.infolist() if not member.is_dir()]
+        # Create the directory tree up front so the workers never race on makedirs
+        for member in zip_ref.infolist():
+            os.makedirs(os.path.join(dest, os.path.dirname(member.filename)), exist_ok=True)
+        # zlib releases the GIL while inflating, so members decompress in parallel
+        with ThreadPoolExecutor() as executor:
+            list(executor.map(lambda member: zip_ref.extract(member, dest), files))
+
 def download_vosk_model(model_name="vosk-model-de-0.21"):
     model_url = f"https://alphacephei.com/vosk/models/{model_name}.zip"
-    model_path = os.path.join(os.path.dirname(__file__), model_name)
+    model_dir = os.path.dirname(__file__)
+    model_path = os.path.join(model_dir, model_name)
     
     if not os.path.exists(model_path):
         print(f"Downloading Vosk model {model_name}...")
-        zip_path, _ = urllib.request.urlretrieve(model_url)
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(os.path.dirname(__file__))
+        zip_path = os.path.join(model_dir, f"{model_name}.zip")
+        with requests.get(model_url, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            with open(zip_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+        extract_zip(zip_path, model_dir)
         os.remove(zip_path)
         print("Model downloaded and extracted.")
     return model_path
 
-def extract_audio(video_path, audio_path):
-    if os.path.exists(audio_path):
-        print(f"File '{audio_path}' already exists. Overwriting...")
-        os.remove(audio_path)
-	
+def get_model(model_path):
+    if model_path not in _MODEL_CACHE:
+        _MODEL_CACHE[model_path] = Model(model_path)
+    return _MODEL_CACHE[model_path]
+
+def transcribe_audio(video_path, model_path):
+    SetLogLevel(0)
+    model = get_model(model_path)
+    rec = KaldiRecognizer(model, SAMPLE_RATE)
+    rec.SetWords(True)
+
+    # Decode the audio track straight to raw 16 kHz mono PCM on stdout instead of a temporary WAV
     command = [
         "ffmpeg",
+        "-threads", "0",
         "-i", video_path,
+        "-vn",
+        "-f", "s16le",
         "-acodec", "pcm_s16le",
         "-ac", "1",
-        "-ar", "16000",
-        audio_path
+        "-ar", str(SAMPLE_RATE),
+        "-"
     ]
-    subprocess.run(command, check=True)
-    print(f"Audio extracted to {audio_path}")
-
-def transcribe_audio(audio_path, model_path):
-    SetLogLevel(0)
-    wf = wave.open(audio_path, "rb")
-    if wf.getnchannels() != 1 or wf.getsampwidth() != 2 or wf.getcomptype() != "NONE":
-        print("Audio file must be WAV format mono PCM.")
-        return []
-
-    model = Model(model_path)
-    rec = KaldiRecognizer(model, wf.getframerate())
-    rec.SetWords(True)
-
     results = []
-    while True:
-        data = wf.readframes(4000)
-        if len(data) == 0:
-            break
-        if rec.AcceptWaveform(data):
-            part_result = json.loads(rec.Result())
-            results.append(part_result)
+    with subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=1 << 20) as proc:
+        while True:
+            data = proc.stdout.read(BLOCK_SIZE)
+            if len(data) == 0:
+                break
+            if rec.AcceptWaveform(data):
+                part_result = json.loads(rec.Result())
+                results.append(part_result)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, command)
     part_result = json.loads(rec.FinalResult())
     results.append(part_result)
 
@@ -70,63 +92,124 @@ def transcribe_audio(audio_path, model_path):
     print(f"Transcribed {len(words)} words")
     return words
 
-def create_text_image(text, size, font_size, color, font_path, bg_color=(0, 0, 0, 0), border_size=15):
-    # Increase the size of the image to accommodate the border
-    increased_size = (size[0] + border_size * 2, size[1] + border_size * 2 + font_size // 2)
-    img = Image.new('RGBA', increased_size, bg_color)
-    draw = ImageDraw.Draw(img)
-    
-    # Load the main font
-    font = ImageFont.truetype(font_path, font_size)
-    
-    # Calculate text position
-    text_bbox = font.getbbox(text)
-    text_width = text_bbox[2] - text_bbox[0]
-    text_height = text_bbox[3] - text_bbox[1]
-    position = ((increased_size[0] - text_width) // 2, (increased_size[1] - text_height) // 2)
-
-    # Draw border
-    for x_offset in range(-border_size, border_size + 1):
-        for y_offset in range(-border_size, border_size + 1):
-            draw.text((position[0] + x_offset, position[1] + y_offset), text, font=font, fill=(0, 0, 0, 255))  # Black border
-
-    # Draw main text
-    draw.text(position, text, font=font, fill=color)
-
-    return np.array(img)
-
-
+def join_words(words):
+    return {'word': ' '.join(w['word'] for w in words), 'start': words[0]['start'], 'end': words[-1]['end']}
 
+def group_words(word_timings, max_words=3, min_duration=0.4, max_gap=0.25):
+    # Vosk sometimes emits blank or zero-length words, nothing would be visible for those.
+    # One-frame (0.03s) words like 'a' or 'I' are real and stay
+    word_timings = [w for w in word_timings if w['end'] > w['start'] and w['word'].strip()]
 
-def create_caption_clips(word_timings, video_width, video_height, font_path):
-    caption_clips = []
+    # Rapid-fire short words become one caption of up to max_words, ending once it lasts min_duration
+    phrases = []
+    words = []
+    for word in word_timings:
+        # Never stretch a caption across a pause
+        if words and word['start'] - words[-1]['end'] > max_gap:
+            phrases.append(join_words(words))
+            words = []
+        words.append(word)
+        if len(words) == max_words or words[-1]['end'] - words[0]['start'] >= min_duration:
+            phrases.append(join_words(words))
+            words = []
+    if words:
+        phrases.append(join_words(words))
+
+    print(f"Grouped {len(word_timings)} words into {len(phrases)} captions")
+    return phrases
+
+def get_video_size(video_path):
+    command = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height",
+        "-of", "csv=p=0:s=x",
+        video_path
+    ]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    width, height = output.strip().split('x')
+    return int(width), int(height)
+
+def format_ass_time(seconds):
+    centiseconds = int(round(seconds * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    secs, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02d}:{secs:02d}.{centiseconds:02d}"
+
+@functools.lru_cache(maxsize=8)
+def get_font_name(font_path):
+    # The full name ("Rubik Black") pins libass to this exact face, the family alone
+    # would match whichever Rubik weight fontconfig prefers
+    return ' '.join(ImageFont.truetype(font_path).getname())
+
+def write_ass_subtitles(word_timings, ass_path, video_width, video_height, font_path):
     font_size = 110  # Increased font size
+    border_size = 15
     y_offset = 570  # Moving subtitles higher up on the screen
+    # Bottom margin that keeps the words centered where the old 120px caption images sat
+    margin_v = y_offset - (120 + border_size * 2 + font_size // 2) // 2 - font_size // 2
+
+    font_name = get_font_name(font_path)
+
+    header = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {video_width}",
+        f"PlayResY: {video_height}",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, "
+        "Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, "
+        "MarginV, Encoding",
+        f"Style: Default,{font_name},{font_size},&H00FFFFFF,&H00FFFFFF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,"
+        f"{border_size},0,2,0,0,{margin_v},1",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+    events = [
+        f"Dialogue: 0,{format_ass_time(word['start'])},{format_ass_time(word['end'])},Default,,0,0,0,,{word['word']}"
+        for word in word_timings
+    ]
 
-    for word in word_timings:
-        img_array = create_text_image(word['word'], (video_width, 120), font_size, (255, 255, 255, 255), font_path)
-        clip = ImageClip(img_array, duration=word['end'] - word['start'])
-        
-        # Adjusting position to move subtitles higher
-        clip = clip.set_position(('center', video_height - y_offset)).set_start(word['start'])
-        
-        caption_clips.append(clip)
-    
-    print(f"Created {len(caption_clips)} caption clips")
-    return caption_clips
+    with open(ass_path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(header + events) + "\n")
 
+    print(f"Wrote {len(events)} subtitle events to {ass_path}")
 
+def escape_filter_path(path):
+    # Filter option values are ':'-separated, so drive letters need escaping and backslashes become slashes
+    return os.path.abspath(path).replace('\\', '/').replace(':', '\\:')
+
+def get_encoder_args():
+    # Encode on the GPU when possible, otherwise trade x264's default "medium" effort for speed
+    if has_nvenc():
+        return ["-c:v", "h264_nvenc", "-preset", "p4", "-rc", "vbr", "-cq", "23"]
+    return ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-threads", "0"]
+
+def burn_subtitles(input_video_path, ass_path, output_video_path, font_path):
+    fonts_dir = os.path.dirname(os.path.abspath(font_path))
+    command = [
+        "ffmpeg",
+        "-y",
+        "-i", input_video_path,
+        "-vf", f"ass='{escape_filter_path(ass_path)}':fontsdir='{escape_filter_path(fonts_dir)}'",
+        *get_encoder_args(),
+        "-c:a", "copy",
+        output_video_path
+    ]
+    subprocess.run(command, check=True)
+    print(f"Captions burned into {output_video_path}")
 
 def main(input_video_path, output_video_path, font_path, tmp_dir):
     # Download Vosk model if not present
     model_path = download_vosk_model()
 
-    # Extract audio from video
-    audio_path = os.path.join(tmp_dir, "temp_audio.wav")
-    extract_audio(input_video_path, audio_path)
-    
-    # Transcribe audio
-    word_timings = transcribe_audio(audio_path, model_path)
+    # Transcribe the video's audio track
+    word_timings = transcribe_audio(input_video_path, model_path)
     
     if not word_timings:
         print("No words were transcribed. Check the audio quality and format.")
@@ -135,26 +218,23 @@ def main(input_video_path, output_video_path, font_path, tmp_dir):
     # Print first 10 transcribed words for debugging
     print(f"First 10 transcribed words: {word_timings[:10]}")
 
-    # Create caption clips
-    video = VideoFileClip(input_video_path)
-    caption_clips = create_caption_clips(word_timings, video.w, video.h, font_path)
-    
-    # Overlay captions on video
-    final_video = CompositeVideoClip([video] + caption_clips)
-    
+    # Merge short adjacent words into phrases
+    phrases = group_words(word_timings)
 
+    # Write all captions into a single subtitle track
+    ass_path = os.path.join(tmp_dir, "captions.ass")
+    video_width, video_height = get_video_size(input_video_path)
+    write_ass_subtitles(phrases, ass_path, video_width, video_height, font_path)
 
+    # Let libass render the captions while ffmpeg re-encodes the video
+    burn_subtitles(input_video_path, ass_path, output_video_path, font_path)
 
-
-    # Write output video
-    final_video.write_videofile(output_video_path,)
-    
     # Clean up temporary files
-    os.remove(audio_path)
+    os.remove(ass_path)
     print("Video processing completed")
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Add captions to video using Vosk and MoviePy.')
+    parser = argparse.ArgumentParser(description='Add captions to video using Vosk and ffmpeg.')
     parser.add_argument('input_video', type=str, help='Path to the input video file')
     parser.add_argument('--font', type=str, default='/home/user/RedditVideoMakerBot-master/fonts/Rubik-Black.ttf', help='Path to the font file')
     args = parser.parse_args()
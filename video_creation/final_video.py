@@ -1,148 +1,175 @@
+import functools
 import multiprocessing
 import os
 import re
-import tempfile
 import textwrap
 import threading
-import time
+from concurrent.futures import ThreadPoolExecutor
 from os.path import exists
 from pathlib import Path
 from typing import Dict, Final, Tuple
 
 import ffmpeg
+import numpy as np
 import translators
 from PIL import Image, ImageDraw, ImageFont
 from rich.console import Console
 from rich.progress import track
+from tqdm import tqdm
 
 from utils import settings
 from utils.cleanup import cleanup
 from utils.console import print_step, print_substep
+from utils.ffmpeg_install import has_filters, has_nvenc, has_timeline_support
 from utils.fonts import getheight
 from utils.id import extract_id
 from utils.thumbnail import create_thumbnail
 from utils.videos import save_data
 
+try:
+    from mutagen import MutagenError
+    from mutagen.mp3 import MP3
+except ModuleNotFoundError:  # durations are probed with ffprobe instead
+    MP3 = None
+
 console = Console()
 
+# (pattern, replacement) pairs name_normalize applies in order, compiled once
+NAME_SUBSTITUTIONS: Final = (
+    (re.compile(r'[?\\"%*:|<>]'), ""),
+    (re.compile(r"( [w,W]\s?\/\s?[o,O,0])"), r" without"),
+    (re.compile(r"( [w,W]\s?\/)"), r" with"),
+    (re.compile(r"(\d+)\s?\/\s?(\d+)"), r"\1 of \2"),
+    (re.compile(r"(\w+)\s?\/\s?(\w+)"), r"\1 or \2"),
+    (re.compile(r"\/"), r""),
+)
+
 
 class ProgressFfmpeg(threading.Thread):
-    def __init__(self, vid_duration_seconds, progress_update_callback):
+    def __init__(self, progress_pipe, vid_duration_seconds, progress_update_callback):
         threading.Thread.__init__(self, name="ProgressFfmpeg")
-        self.stop_event = threading.Event()
-        self.output_file = tempfile.NamedTemporaryFile(mode="w+", delete=False)
+        # ffmpeg writes its -progress report here, one key=value per line
+        self.progress_pipe = progress_pipe
         self.vid_duration_seconds = vid_duration_seconds
         self.progress_update_callback = progress_update_callback
 
     def run(self):
-        while not self.stop_event.is_set():
-            latest_progress = self.get_latest_ms_progress()
+        # readline blocks until ffmpeg reports, and returns b"" once ffmpeg closes the pipe
+        for line in iter(self.progress_pipe.readline, b""):
+            latest_progress = self.parse_ms_progress(line.decode("utf8"))
             if latest_progress is not None:
                 completed_percent = latest_progress / self.vid_duration_seconds
                 self.progress_update_callback(completed_percent)
-            time.sleep(1)
-
-    def get_latest_ms_progress(self):
-        lines = self.output_file.readlines()
-
-        for line in lines:
-            if "out_time_ms" in line:
-                out_time_ms_str = line.split("=")[1].strip()
-                if out_time_ms_str.isnumeric():
-                    return float(out_time_ms_str) / 1000000.0
-                else:
-                    return None
-        return None
 
-    def stop(self):
-        self.stop_event.set()
+    @staticmethod
+    def parse_ms_progress(line):
+        if line.startswith("out_time_ms="):
+            out_time_ms_str = line.split("=")[1].strip()
+            if out_time_ms_str.isnumeric():
+                return float(out_time_ms_str) / 1000000.0
+        return None
 
     def __enter__(self):
         self.start()
         return self
 
     def __exit__(self, *args, **kwargs):
-        self.stop()
+        self.join()
 
 
 def name_normalize(name: str) -> str:
-    name = re.sub(r'[?\\"%*:|<>]', "", name)
-    name = re.sub(r"( [w,W]\s?\/\s?[o,O,0])", r" without", name)
-    name = re.sub(r"( [w,W]\s?\/)", r" with", name)
-    name = re.sub(r"(\d+)\s?\/\s?(\d+)", r"\1 of \2", name)
-    name = re.sub(r"(\w+)\s?\/\s?(\w+)", r"\1 or \2", name)
-    name = re.sub(r"\/", r"", name)
+    for pattern, replacement in NAME_SUBSTITUTIONS:
+        name = pattern.sub(replacement, name)
 
     lang = settings.config["reddit"]["thread"]["post_lang"]
     if lang:
-        print_substep("Translating filename...")
-        return translators.translate_text(name, translator="google", to_language=lang)
+        return translate_name(name, lang)
     return name
 
 
-def prepare_background(reddit_id: str, W: int, H: int) -> str:
-    output_path = f"assets/temp/{reddit_id}/background_noaudio.mp4"
-    output = (
-        ffmpeg.input(f"assets/temp/{reddit_id}/background.mp4")
-        .filter("crop", f"ih*({W}/{H})", "ih")
-        .output(
-            output_path,
-            an=None,
-            **{
-                "c:v": "h264",
-                "b:v": "20M",
-                "b:a": "192k",
-                "threads": multiprocessing.cpu_count(),
-            },
-        )
-        .overwrite_output()
+@functools.lru_cache(maxsize=256)
+def translate_name(name: str, lang: str) -> str:
+    # The title is normalized for both the title image and the filename, translate it only once
+    print_substep("Translating filename...")
+    return translators.translate_text(name, translator="google", to_language=lang)
+
+
+def get_video_codec_options() -> dict:
+    """Encoder options for H.264 output, using NVENC when the GPU encoder is usable."""
+    if has_nvenc():
+        return {"c:v": "h264_nvenc", "preset": "p4", "rc": "vbr", "cq": 23, "b:v": "20M"}
+    # At 20M the bitrate carries the quality, x264's default "medium" effort mostly costs time
+    return {"c:v": "libx264", "preset": "ultrafast", "b:v": "20M"}
+
+
+def get_decoder_options() -> dict:
+    """Input options that move video decoding to the GPU alongside NVENC."""
+    return {"hwaccel": "cuda"} if has_nvenc() else {}
+
+
+def use_cuda_filters() -> bool:
+    """Whether frames can be overlaid and scaled on the GPU and handed to NVENC without leaving VRAM."""
+    return (
+        has_nvenc()
+        and has_filters("hwupload_cuda", "overlay_cuda", "scale_cuda")
+        # The screenshots are only shown during their clip through overlay's enable= option
+        and has_timeline_support("overlay_cuda")
     )
-    try:
-        output.run(quiet=True)
-    except ffmpeg.Error as e:
-        print(e.stderr.decode("utf8"))
-        exit(1)
-    return output_path
 
 
-def get_text_height(draw, text, font, max_width):
-    lines = textwrap.wrap(text, width=max_width)
-    return sum(draw.textbbox((0, 0), line, font=font)[3] for line in lines)
+def get_line_height(font):
+    # Ascent + descent is the same for every line of a font, no need to measure each one
+    ascent, descent = font.getmetrics()
+    return ascent + descent
+
+
+def get_text_height(lines, font):
+    return len(lines) * get_line_height(font)
+
+
+@functools.lru_cache(maxsize=None)
+def get_title_font(size: int):
+    """Roboto Bold at the given size, parsed once per run."""
+    return ImageFont.truetype(os.path.join("fonts", "Roboto-Bold.ttf"), size)
+
+
+@functools.lru_cache(maxsize=None)
+def get_title_template():
+    """The title card template, decoded once per run. Callers draw on a .copy() of it."""
+    with Image.open("assets/title_template.png") as template:
+        return template.convert("RGBA")
 
 
 def create_fancy_thumbnail(image, text, text_color, padding, wrap=35):
     print_step(f"Creating fancy thumbnail for: {text}")
     font_title_size = 47
-    font = ImageFont.truetype(os.path.join("fonts", "Roboto-Bold.ttf"), font_title_size)
+    font = get_title_font(font_title_size)
     image_width, image_height = image.size
 
-    draw = ImageDraw.Draw(image)
-    text_height = get_text_height(draw, text, font, wrap)
     lines = textwrap.wrap(text, width=wrap)
+    text_height = get_text_height(lines, font)
     new_image_height = image_height + text_height + padding * (len(lines) - 1) - 50
 
     top_part_height = image_height // 2
     bottom_part_height = image_height - top_part_height - 1
     new_middle_height = max(1, new_image_height - top_part_height - bottom_part_height)
 
-    top_part = image.crop((0, 0, image_width, top_part_height))
-    middle_part = image.crop((0, top_part_height, image_width, top_part_height + 1))
-    bottom_part = image.crop((0, top_part_height + 1, image_width, image_height))
-
-    middle_part = middle_part.resize((image_width, new_middle_height))
-
-    new_image = Image.new("RGBA", (image_width, new_image_height))
-    new_image.paste(top_part, (0, 0))
-    new_image.paste(middle_part, (0, top_part_height))
-    new_image.paste(bottom_part, (0, top_part_height + new_middle_height))
+    # Stretch the template by repeating its middle row, built as one contiguous buffer
+    pixels = np.asarray(image.convert("RGBA"))
+    middle_part = np.repeat(pixels[top_part_height : top_part_height + 1], new_middle_height, axis=0)
+    new_pixels = np.concatenate(
+        (pixels[:top_part_height], middle_part, pixels[top_part_height + 1 :]), axis=0
+    )
+    new_image = Image.fromarray(new_pixels[:new_image_height], "RGBA")
 
     draw = ImageDraw.Draw(new_image)
     y = top_part_height + padding
+    line_height = get_line_height(font)
     for line in lines:
         draw.text((120, y), line, font=font, fill=text_color, align="left")
-        y += get_text_height(draw, line, font, wrap) + padding
+        y += line_height + padding
 
-    username_font = ImageFont.truetype(os.path.join("fonts", "Roboto-Bold.ttf"), 30)
+    username_font = get_title_font(30)
     draw.text(
         (205, 825),
         settings.config["settings"]["channel_name"],
@@ -191,14 +218,12 @@ def make_final_video(
     audio_clips = gather_audio_clips(number_of_clips, reddit_id, reddit_obj)
 
     # Concatenate audio clips
-    final_audio_path = f"assets/temp/{reddit_id}/audio.mp3"
-    concatenate_audio_clips(audio_clips, final_audio_path)
+    audio = concatenate_audio_clips(audio_clips)
 
     # Log video length
     console.log(f"[bold green] Video Will Be: {length} Seconds Long")
 
     # Prepare final audio
-    audio = ffmpeg.input(final_audio_path)
     final_audio = merge_background_audio(audio, reddit_id)
 
     # Create title image
@@ -211,6 +236,12 @@ def make_final_video(
     # Gather audio clip durations
     audio_clips_durations = get_audio_clips_durations(number_of_clips, reddit_id)
 
+    # Upload the background once, the overlays, speed change and scaling then all run in VRAM
+    if use_cuda_filters():
+        # drawtext has no CUDA variant, so the credit is drawn before the upload on this path
+        background_clip = add_background_credit(background_clip, background_config)
+        background_clip = background_clip.filter("format", "yuv420p").filter("hwupload_cuda")
+
     # Overlay images on background
     background_clip = overlay_images_on_background(
         background_clip,
@@ -240,11 +271,13 @@ def make_final_video(
     # Adjust audio speed
     final_audio = final_audio.filter('atempo', speed_factor)
 
-    # Add background credit
-    background_clip = add_background_credit(background_clip, background_config)
-
-    # Scale background clip
-    background_clip = background_clip.filter("scale", W, H)
+    # Scale background clip, on the GPU when the encoder can take CUDA frames directly
+    if use_cuda_filters():
+        background_clip = background_clip.filter("scale_cuda", W, H)
+    else:
+        # Add background credit
+        background_clip = add_background_credit(background_clip, background_config)
+        background_clip = background_clip.filter("scale", W, H)
     print_step("Rendering the video 🎥")
 
     # Render the main video
@@ -256,8 +289,10 @@ def make_final_video(
     # Render the Only TTS video if enabled
     if allow_only_tts_folder:
         only_tts_path = os.path.join(default_path, "OnlyTTS", f"{filename}.mp4")
+        os.makedirs(os.path.dirname(only_tts_path), exist_ok=True)
         print_step("Rendering the Only TTS Video 🎥")
-        render_video(background_clip, audio, only_tts_path, length)
+        # Same picture as the main video, so only the audio track has to be encoded
+        remux_audio(video_path, audio, only_tts_path)
 
     # Save data and cleanup
     save_data(subreddit, f"{filename}.mp4", title, idx, background_config["video"][2])
@@ -280,43 +315,33 @@ def initial_setup(reddit_obj: dict):
 
 
 def prepare_background_clip(reddit_id: str, W: int, H: int):
-    background_path = prepare_background(reddit_id, W=W, H=H)
-    return ffmpeg.input(background_path)
+    # Crop inside the render graph so the background is decoded and encoded only once
+    background_path = f"assets/temp/{reddit_id}/background.mp4"
+    background_clip = ffmpeg.input(background_path, **get_decoder_options())["v"]
+    return background_clip.filter("crop", f"ih*({W}/{H})", "ih")
 
 
 def gather_audio_clips(number_of_clips: int, reddit_id: str, reddit_obj: dict):
-    audio_clips = []
     storymode = settings.config["settings"]["storymode"]
     if number_of_clips == 0 and storymode == "false":
         print("No audio clips to gather. Please use a different TTS or post.")
         exit()
-    if storymode:
-        if settings.config["settings"]["storymodemethod"] == 0:
-            audio_clips = [ffmpeg.input(f"assets/temp/{reddit_id}/mp3/title.mp3")]
-            audio_clips.insert(1, ffmpeg.input(f"assets/temp/{reddit_id}/mp3/postaudio.mp3"))
-        elif settings.config["settings"]["storymodemethod"] == 1:
-            audio_clips = [
-                ffmpeg.input(f"assets/temp/{reddit_id}/mp3/postaudio-{i}.mp3")
-                for i in track(range(number_of_clips + 1), "Collecting the audio files...")
-            ]
-            audio_clips.insert(0, ffmpeg.input(f"assets/temp/{reddit_id}/mp3/title.mp3"))
-    else:
-        audio_clips = [
-            ffmpeg.input(f"assets/temp/{reddit_id}/mp3/{i}.mp3") for i in range(number_of_clips)
-        ]
-        audio_clips.insert(0, ffmpeg.input(f"assets/temp/{reddit_id}/mp3/title.mp3"))
-    return audio_clips
+    # One concat demuxer input reads the clips back to back, instead of one input per clip
+    list_path = f"assets/temp/{reddit_id}/mp3/narration_list.txt"
+    with open(list_path, "w", encoding="utf-8") as list_file:
+        for path in get_audio_clip_paths(number_of_clips, reddit_id):
+            escaped_path = os.path.abspath(path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped_path}'\n")
+    return ffmpeg.input(list_path, f="concat", safe=0)
 
 
-def concatenate_audio_clips(audio_clips, output_path):
-    audio_concat = ffmpeg.concat(*audio_clips, a=1, v=0)
-    ffmpeg.output(
-        audio_concat, output_path, **{"b:a": "192k"}
-    ).overwrite_output().run(quiet=True)
+def concatenate_audio_clips(audio_clips):
+    # Stays part of the render graph, so the audio is only encoded once in the final mux
+    return audio_clips["a"]
 
 
 def create_title_image(reddit_obj: dict, reddit_id: str):
-    title_template = Image.open("assets/title_template.png")
+    title_template = get_title_template().copy()
     title = name_normalize(reddit_obj["thread_title"])
     font_color = "#000000"
     padding = 5
@@ -326,34 +351,69 @@ def create_title_image(reddit_obj: dict, reddit_id: str):
     return f"assets/temp/{reddit_id}/png/title.png"
 
 
-def get_audio_clips_durations(number_of_clips: int, reddit_id: str):
-    audio_clips_durations = []
+def get_audio_clip_paths(number_of_clips: int, reddit_id: str):
+    audio_clip_paths = []
     storymode = settings.config["settings"]["storymode"]
     if storymode:
         if settings.config["settings"]["storymodemethod"] == 0:
-            audio_clips_durations = [
-                float(ffmpeg.probe(f"assets/temp/{reddit_id}/mp3/title.mp3")["format"]["duration"]),
-                float(ffmpeg.probe(f"assets/temp/{reddit_id}/mp3/postaudio.mp3")["format"]["duration"]),
+            audio_clip_paths = [
+                f"assets/temp/{reddit_id}/mp3/title.mp3",
+                f"assets/temp/{reddit_id}/mp3/postaudio.mp3",
             ]
         elif settings.config["settings"]["storymodemethod"] == 1:
-            audio_clips_durations = [
-                float(ffmpeg.probe(f"assets/temp/{reddit_id}/mp3/postaudio-{i}.mp3")["format"]["duration"])
-                for i in range(number_of_clips + 1)
+            audio_clip_paths = [
+                f"assets/temp/{reddit_id}/mp3/postaudio-{i}.mp3" for i in range(number_of_clips + 1)
             ]
-            audio_clips_durations.insert(
-                0,
-                float(ffmpeg.probe(f"assets/temp/{reddit_id}/mp3/title.mp3")["format"]["duration"]),
-            )
+            audio_clip_paths.insert(0, f"assets/temp/{reddit_id}/mp3/title.mp3")
     else:
-        audio_clips_durations = [
-            float(ffmpeg.probe(f"assets/temp/{reddit_id}/mp3/{i}.mp3")["format"]["duration"])
-            for i in range(number_of_clips)
-        ]
-        audio_clips_durations.insert(
-            0,
-            float(ffmpeg.probe(f"assets/temp/{reddit_id}/mp3/title.mp3")["format"]["duration"]),
-        )
-    return audio_clips_durations
+        audio_clip_paths = [f"assets/temp/{reddit_id}/mp3/{i}.mp3" for i in range(number_of_clips)]
+        audio_clip_paths.insert(0, f"assets/temp/{reddit_id}/mp3/title.mp3")
+    return audio_clip_paths
+
+
+def get_audio_duration(path: str) -> float:
+    # Reading the MP3 headers is much cheaper than spawning an ffprobe process
+    if MP3 is not None:
+        # Some engines (pyttsx) write WAV/AIFF into the .mp3 files, ffprobe reads the real container
+        try:
+            info = MP3(path).info
+            if not info.sketchy:
+                return info.length
+        except MutagenError:
+            pass
+    return float(ffmpeg.probe(path)["format"]["duration"])
+
+
+def get_audio_clips_durations(number_of_clips: int, reddit_id: str):
+    audio_clip_paths = get_audio_clip_paths(number_of_clips, reddit_id)
+    if MP3 is not None:
+        return [get_audio_duration(path) for path in audio_clip_paths]
+    # Each ffprobe is its own process, so the probes can simply run side by side
+    with ThreadPoolExecutor(max_workers=multiprocessing.cpu_count()) as executor:
+        return list(executor.map(get_audio_duration, audio_clip_paths))
+
+
+def apply_opacity(path: str, opacity: float):
+    """Scales the alpha channel of the image at path by opacity, in place."""
+    with Image.open(path) as image:
+        pixels = np.array(image.convert("RGBA"))
+    # Baked into the png once, so ffmpeg does not run a colorchannelmixer pass on every frame
+    np.multiply(pixels[..., 3], opacity, out=pixels[..., 3], casting="unsafe")
+    Image.fromarray(pixels, "RGBA").save(path)
+
+
+def overlay_image(background_clip, image_clip, start: float, end: float):
+    """Overlays image_clip centered on background_clip from start to end (in seconds)."""
+    overlay_options = {
+        "x": "(main_w-overlay_w)/2",
+        "y": "(main_h-overlay_h)/2",
+        "enable": f"between(t,{start:.6f},{end:.6f})",
+    }
+    if use_cuda_filters():
+        # The background is already in VRAM, upload the (single frame) image next to it
+        image_clip = image_clip.filter("format", "yuva420p").filter("hwupload_cuda")
+        return ffmpeg.filter([background_clip, image_clip], "overlay_cuda", **overlay_options)
+    return background_clip.overlay(image_clip, **overlay_options)
 
 
 def overlay_images_on_background(
@@ -365,7 +425,9 @@ def overlay_images_on_background(
     opacity,
     screenshot_width,
 ):
-    current_time = 0
+    # Each clip shows while its audio plays, so the windows are the running sum of the durations
+    ends = np.cumsum(audio_clips_durations, dtype=np.float64)
+    starts = np.concatenate(([0.0], ends[:-1]))
     storymode = settings.config["settings"]["storymode"]
     if storymode:
         if settings.config["settings"]["storymodemethod"] == 0:
@@ -376,13 +438,12 @@ def overlay_images_on_background(
                 ),
             )
             for i in range(2):
-                background_clip = background_clip.overlay(
+                background_clip = overlay_image(
+                    background_clip,
                     image_clips[i],
-                    enable=f"between(t,{current_time},{current_time + audio_clips_durations[i]})",
-                    x="(main_w-overlay_w)/2",
-                    y="(main_h-overlay_h)/2",
+                    starts[i],
+                    ends[i],
                 )
-                current_time += audio_clips_durations[i]
         elif settings.config["settings"]["storymodemethod"] == 1:
             if settings.config["settings"]["storymodemethod_cap_cut"] == False:
                 for i in track(range(0, number_of_clips + 1), "Collecting the image files..."):
@@ -391,46 +452,50 @@ def overlay_images_on_background(
                             "scale", screenshot_width, -1
                         )
                     )
-                    background_clip = background_clip.overlay(
+                    background_clip = overlay_image(
+                        background_clip,
                         image_clips[i],
-                        enable=f"between(t,{current_time},{current_time + audio_clips_durations[i]})",
-                        x="(main_w-overlay_w)/2",
-                        y="(main_h-overlay_h)/2",
+                        starts[i],
+                        ends[i],
                     )
-                    current_time += audio_clips_durations[i]
             else:
+                # Create one transparent image and reuse its input for all other clips
+                transparent_path = f"assets/temp/{reddit_id}/png/trs.png"
+                transparent_image = Image.new(
+                    "RGBA", (screenshot_width, screenshot_width), (0, 0, 0, 0)
+                )
+                transparent_image.save(transparent_path)
+                transparent_clip = ffmpeg.input(transparent_path)["v"].filter(
+                    "scale", screenshot_width, -1
+                )
+                # A filter output can only feed one overlay, so split it into a stream per clip
+                transparent_clips = transparent_clip.split()
                 for i in track(range(0, number_of_clips + 1), "Collecting the image files..."):
-                    # Create a transparent image for other clips
-                    transparent_image = Image.new('RGBA', (screenshot_width, screenshot_width), (0, 0, 0, 0))
-                    transparent_image.save(f"assets/temp/{reddit_id}/png/trs{i}.png")
-
-                    image_clips.append(
-                        ffmpeg.input(f"assets/temp/{reddit_id}/png/trs{i}.png")["v"].filter(
-                            "scale", screenshot_width, -1
-                        )
-                    )
-                    background_clip = background_clip.overlay(
+                    image_clips.append(transparent_clips[i])
+                    background_clip = overlay_image(
+                        background_clip,
                         image_clips[i],
-                        enable=f"between(t,{current_time},{current_time + audio_clips_durations[i]})",
-                        x="(main_w-overlay_w)/2",
-                        y="(main_h-overlay_h)/2",
+                        starts[i],
+                        ends[i],
                     )
-                    current_time += audio_clips_durations[i]
     else:
+        # image_clips already holds the title, each comment follows it
+        comment_paths = [
+            f"assets/temp/{reddit_id}/png/comment_{i}.png" for i in range(number_of_clips)
+        ]
+        # At full opacity the alpha is left as is
+        if opacity < 1:
+            for path in [f"assets/temp/{reddit_id}/png/title.png", *comment_paths]:
+                apply_opacity(path, opacity)
+        for path in comment_paths:
+            image_clips.append(ffmpeg.input(path)["v"].filter("scale", screenshot_width, -1))
         for i in range(0, number_of_clips + 1):
-            image_clips.append(
-                ffmpeg.input(f"assets/temp/{reddit_id}/png/comment_{i}.png")["v"].filter(
-                    "scale", screenshot_width, -1
-                )
-            )
-            image_overlay = image_clips[i].filter("colorchannelmixer", aa=opacity)
-            background_clip = background_clip.overlay(
-                image_overlay,
-                enable=f"between(t,{current_time},{current_time + audio_clips_durations[i]})",
-                x="(main_w-overlay_w)/2",
-                y="(main_h-overlay_h)/2",
+            background_clip = overlay_image(
+                background_clip,
+                image_clips[i],
+                starts[i],
+                ends[i],
             )
-            current_time += audio_clips_durations[i]
     return background_clip
 
 
@@ -503,8 +568,6 @@ def add_background_credit(background_clip, background_config):
 
 
 def render_video(background_clip, final_audio, path, length):
-    from tqdm import tqdm
-
     pbar = tqdm(total=100, desc="Progress: ", bar_format="{l_bar}{bar}", unit=" %")
 
     def on_update_example(progress) -> None:
@@ -512,28 +575,54 @@ def render_video(background_clip, final_audio, path, length):
         old_percentage = pbar.n
         pbar.update(status - old_percentage)
 
-    with ProgressFfmpeg(length, on_update_example) as progress:
-        try:
-            ffmpeg.output(
-                background_clip,
-                final_audio,
-                path,
-                f="mp4",
-                **{
-                    "c:v": "h264",
-                    "b:v": "20M",
-                    "b:a": "192k",
-                    "threads": multiprocessing.cpu_count(),
-                },
-            ).overwrite_output().global_args("-progress", progress.output_file.name).run(
-                quiet=True,
-                overwrite_output=True,
-                capture_stdout=False,
-                capture_stderr=False,
-            )
-        except ffmpeg.Error as e:
-            print(e.stderr.decode("utf8"))
-            exit(1)
+    process = (
+        ffmpeg.output(
+            background_clip,
+            final_audio,
+            path,
+            f="mp4",
+            **get_video_codec_options(),
+            **{"b:a": "192k"},
+        )
+        .overwrite_output()
+        .global_args(
+            # Stream the progress report over stdout instead of a file that has to be polled
+            "-progress",
+            "pipe:1",
+            "-nostats",
+            # Let the overlay chain run its filters on all cores, the encoder picks its own threads
+            "-filter_complex_threads",
+            str(multiprocessing.cpu_count()),
+            "-filter_threads",
+            str(multiprocessing.cpu_count()),
+        )
+        .run_async(pipe_stdout=True, pipe_stderr=True)
+    )
+    with ProgressFfmpeg(process.stdout, length, on_update_example):
+        # Drain stderr while rendering so ffmpeg never blocks on a full pipe
+        stderr = process.stderr.read()
+        process.wait()
+    if process.returncode != 0:
+        print(stderr.decode("utf8"))
+        exit(1)
     old_percentage = pbar.n
     pbar.update(100 - old_percentage)
     pbar.close()
+
+
+def remux_audio(video_path, audio, path):
+    """Copies the video stream of an already rendered video and muxes a different audio track in."""
+    try:
+        ffmpeg.output(
+            ffmpeg.input(video_path)["v"],
+            audio,
+            path,
+            f="mp4",
+            **{
+                "c:v": "copy",
+                "b:a": "192k",
+            },
+        ).overwrite_output().run(quiet=True)
+    except ffmpeg.Error as e:
+        print(e.stderr.decode("utf8"))
+        exit(1)